@@ -29,6 +29,9 @@ def main():
 
   # 批量修复（覆盖原文件）
   %(prog)s *.epub --overwrite
+
+  # 批量修复（使用4个进程并行处理）
+  %(prog)s *.epub -d ./fixed/ -j 4
         """
     )
     
@@ -54,6 +57,19 @@ def main():
         help='覆盖原文件（如果不指定输出路径）'
     )
     
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='批量处理时的并行进程数（默认为CPU核心数）'
+    )
+    
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help='使用最快的压缩级别（输出文件稍大）'
+    )
+    
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -71,6 +87,10 @@ def main():
         print("错误: 必须指定输出位置 (-o, -d) 或使用 --overwrite")
         sys.exit(1)
     
+    if args.jobs is not None and args.jobs < 1:
+        print("错误: -j/--jobs 参数必须大于0")
+        sys.exit(1)
+    
     # 创建修复器
     fixer = EPUBFixer()
     
@@ -95,7 +115,7 @@ def main():
         if args.verbose:
             print(f"  输出到: {output_file if output_file else '(覆盖原文件)'}")
         
-        success = fixer.fix_epub(input_file, output_file)
+        success = fixer.fix_epub(input_file, output_file, fast=args.fast)
         
         if success:
             print("✓ 处理完成!")
@@ -124,7 +144,7 @@ def main():
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
         
-        result = fixer.batch_fix(valid_files, output_dir)
+        result = fixer.batch_fix(valid_files, output_dir, max_workers=args.jobs, fast=args.fast)
         
         print()
         print("=" * 50)
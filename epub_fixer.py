@@ -5,13 +5,153 @@ EPUB格式修复核心模块
 修复机翻后的EPUB文件中的文字排版方向和字体问题
 """
 
+import functools
+import io
+import multiprocessing
 import os
-import zipfile
-import tempfile
+import posixpath
+import re
 import shutil
-from typing import List, Optional
-from ebooklib import epub
-from bs4 import BeautifulSoup
+import sys
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+from lxml import etree
+
+
+# OPF清单中需要修复的文件类型
+_HTML_MEDIA_TYPES = ('application/xhtml+xml', 'text/html')
+_CSS_MEDIA_TYPE = 'text/css'
+
+# 清单中需要修复的条目类型
+_ITEM_DOCUMENT = 'html'
+_ITEM_STYLE = 'css'
+
+# 已经压缩过的媒体文件，重新打包时直接存储，不再浪费CPU做deflate
+# （ttf/otf字体本身未压缩，仍按文本条目deflate）
+_STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4',
+                      '.woff', '.woff2')
+# 文本条目的deflate级别：默认兼顾速度与体积，fast模式使用最快级别
+_COMPRESSLEVEL = 3
+_FAST_COMPRESSLEVEL = 1
+# Windows上ProcessPoolExecutor最多只能使用61个工作进程
+_WINDOWS_MAX_WORKERS = 61
+
+# 全局修复CSS文件名及其在OPF清单中的id
+_FIX_CSS_FILENAME = 'epub_fixer.css'
+_FIX_CSS_ITEM_ID = 'epub-fixer-css'
+# 流式复制条目及写出压缩包时的缓冲区大小
+_COPY_BUFSIZE = 1 << 20
+# 小于该大小的EPUB整体读入内存后再解压
+_IN_MEMORY_LIMIT = 5 * 1024 * 1024
+
+# 进程内复用的XHTML解析器（容错模式，用于正则无法处理的文档）
+_XHTML_PARSER = etree.XMLParser(recover=True)
+_STYLED_XPATH = etree.XPath('//*[@style]')
+# head是根元素的直接子元素，不区分是否带XHTML命名空间
+_HEAD_XPATH = etree.XPath('/*/*[local-name()="head"]')
+
+# container.xml中指向OPF文件的rootfile路径
+_CONTAINER_NAME = 'META-INF/container.xml'
+_ROOTFILE_PATH_XPATH = etree.XPath(
+    '//c:rootfiles/c:rootfile/@full-path',
+    namespaces={'c': 'urn:oasis:names:tc:opendocument:xmlns:container'})
+
+# OPF解析用的预编译XPath
+_OPF_NAMESPACES = {'opf': 'http://www.idpf.org/2007/opf'}
+_MANIFEST_XPATH = etree.XPath('//opf:manifest', namespaces=_OPF_NAMESPACES)
+_MANIFEST_ITEMS_XPATH = etree.XPath('//opf:manifest/opf:item', namespaces=_OPF_NAMESPACES)
+_SPINE_XPATH = etree.XPath('//opf:spine', namespaces=_OPF_NAMESPACES)
+_OPF_ITEM_TAG = f"{{{_OPF_NAMESPACES['opf']}}}item"
+
+# 竖排相关的writing-mode取值
+_VERTICAL_VALUES = r'(?:vertical-rl|vertical-lr|tb-rl|tb-lr)'
+
+# style属性：一次扫描同时匹配三类需要修复的声明
+#   vertical：竖排writing-mode（含-webkit-/-epub-前缀），统一改为横排
+#   drop：text-orientation以及带前缀的竖排声明，直接移除
+#   overline：text-decoration中的overline，改为underline
+_STYLE_FIX_RE = re.compile(
+    r'(?<![-\w])(?:'
+    r'(?P<vertical>(?:-webkit-|-epub-)?writing-mode\s*:[^;]*?' + _VERTICAL_VALUES + r'[^;]*)'
+    r'|(?P<drop>(?:(?:-(?:webkit|epub)-)?text-orientation\s*:[^;]*|-(?:webkit|epub)-writing-mode\s*:[^;]*vertical[^;]*)(?:;\s*|$))'
+    r'|(?P<overline>text-decoration[-\w]*\s*:[^;]*?)overline'
+    r')',
+    re.IGNORECASE)
+
+# 需要修复的关键字，不含任何一个时可以跳过改写
+_FIX_MARKER_RE = re.compile(rb'writing-mode|text-orientation|overline', re.IGNORECASE)
+
+# CSS：一次扫描同时匹配三类需要修复的声明（直接处理字节，关键字均为ASCII）
+#   vertical：竖排writing-mode取值，替换为horizontal-tb
+#   comment：text-orientation以及带前缀的竖排声明，注释掉（已注释的不再重复注释）
+#   overline：text-decoration / text-decoration-line中的overline，改为underline
+_CSS_FIX_RE = re.compile(
+    rb'(?P<vertical>(?:-webkit-|-epub-)?writing-mode\s*:\s*)' + _VERTICAL_VALUES.encode('ascii') +
+    rb'|(?<!/\* )(?<![-\w])(?P<comment>(?:-(?:webkit|epub)-)?text-orientation\s*:[^;}\n]*'
+    rb'|-(?:webkit|epub)-writing-mode\s*:[^;}\n]*vertical[^;}\n]*);?'
+    rb'|(?P<overline>text-decoration(?:-line)?\s*:[^;}]*?)overline',
+    re.IGNORECASE)
+
+# HTML：带双引号style属性的开始标签（第1组为标签名，第2组为style取值）
+# 其前的属性按整段引号值匹配，属性值中合法出现的">"不会截断标签
+_STYLED_TAG_RE = re.compile(
+    rb'<([A-Za-z][\w:.-]*)(?:[^<>"\']|"[^"]*"|\'[^\']*\')*?\sstyle\s*=\s*"([^"]*)"',
+    re.IGNORECASE)
+# HTML：单引号或无引号的style属性
+_UNQUOTED_STYLE_ATTR_RE = re.compile(rb'\sstyle\s*=\s*[^"\s]', re.IGNORECASE)
+# HTML：无引号的style取值，XML解析前补上双引号，否则recover模式会丢弃该属性
+_UNQUOTED_STYLE_VALUE_RE = re.compile(rb'(\sstyle\s*=\s*)([^"\'\s>]+)', re.IGNORECASE)
+_HEAD_OPEN_RE = re.compile(rb'<head[\s/>]', re.IGNORECASE)
+_HEAD_CLOSE_RE = re.compile(rb'</head\s*>', re.IGNORECASE)
+# HTML：注释、CDATA或脚本中可能出现"</head>"字样，位于真正的</head>之前时无法用正则定位插入点
+_HEAD_UNSAFE_RE = re.compile(rb'<!--|<!\[CDATA\[|<script', re.IGNORECASE)
+
+
+# 注入到EPUB中的修复样式
+_FIX_CSS = """
+/* EPUB格式修复样式 */
+body {
+    writing-mode: horizontal-tb !important;
+    -webkit-writing-mode: horizontal-tb !important;
+    -epub-writing-mode: horizontal-tb !important;
+    direction: ltr;
+}
+
+/* 确保中文字体正确显示 */
+body, p, div, span {
+    font-family: "Microsoft YaHei", "SimSun", "PingFang SC", "Noto Sans CJK SC", sans-serif;
+}
+
+/* 目录页链接统一使用下划线，避免出现上划线 */
+/* 常见目录页class: body.p-toc, .p-toc, .toc */
+body.p-toc a,
+.p-toc a,
+.toc a,
+body[class*="toc"] a {
+    text-decoration-line: underline !important;
+    text-decoration-thickness: auto;
+    text-underline-position: under !important;
+    text-decoration-skip-ink: auto;
+    border-top: none !important; /* 避免使用边框制造上划线 */
+}
+
+/* 如果有显式的overline声明，强制改为underline */
+a[style*="overline"],
+body.p-toc a[style],
+.p-toc a[style],
+.toc a[style] {
+    text-decoration-line: underline !important;
+}
+"""
+_FIX_CSS_BYTES = _FIX_CSS.encode('utf-8')
+_FIX_STYLE_ID = b'id="epub-fixer-style"'
+# 每个HTML文档通过link引用同一个全局修复CSS文件
+_FIX_LINK_TEMPLATE = b'<link href="%s" rel="stylesheet" type="text/css" ' + _FIX_STYLE_ID + b'/>'
+# 完整解析路径中link元素除href外的固定属性
+_FIX_LINK_ATTRIB = {'rel': 'stylesheet', 'type': 'text/css', 'id': 'epub-fixer-style'}
 
 
 class EPUBFixer:
@@ -22,161 +162,230 @@ class EPUBFixer:
         self.total_files = 0
         self.current_file = ""
         
-    def fix_epub(self, input_path: str, output_path: Optional[str] = None) -> bool:
+    def fix_epub(self, input_path: str, output_path: Optional[str] = None,
+                 fast: bool = False) -> bool:
         """
         修复单个EPUB文件
         
         Args:
             input_path: 输入EPUB文件路径
             output_path: 输出EPUB文件路径，如果为None则覆盖原文件
+            fast: 是否使用最快的压缩级别（输出稍大，适合批量处理）
             
         Returns:
             bool: 修复是否成功
         """
+        compresslevel = _FAST_COMPRESSLEVEL if fast else _COMPRESSLEVEL
+        tmp_out = None
         try:
             self.current_file = os.path.basename(input_path)
             
-            # 如果output_path为None，使用临时文件
+            # 如果output_path为None，覆盖原文件
             if output_path is None:
                 output_path = input_path
             
-            # 创建临时目录来处理EPUB
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # 解压EPUB到临时目录
-                with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                
-                # 使用ebooklib读取EPUB结构（用于获取元数据和列表）
-                book = epub.read_epub(input_path)
-                
-                # 查找并修复所有HTML文件
-                for item in book.get_items():
-                    if item.get_type() == 9:  # ITEM_DOCUMENT
-                        # 找到文件在解压目录中的实际路径
-                        file_found = False
-                        for prefix in ['EPUB/', 'OEBPS/', '']:
-                            file_path = os.path.join(temp_dir, prefix, item.file_name)
-                            if os.path.exists(file_path):
-                                # 读取并修复HTML内容
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    content = f.read().encode('utf-8')
-                                
-                                fixed_content = self._fix_html_content(content)
-                                
-                                # 写回修复后的内容
-                                with open(file_path, 'wb') as f:
-                                    f.write(fixed_content)
-                                
-                                file_found = True
-                                break
-                        
-                        if not file_found:
-                            print(f"警告: 未找到文件 {item.file_name}")
-                
-                # 修复CSS样式表
-                for item in book.get_items():
-                    if item.get_type() == 2:  # ITEM_STYLE
-                        file_found = False
-                        for prefix in ['EPUB/', 'OEBPS/', '']:
-                            file_path = os.path.join(temp_dir, prefix, item.file_name)
-                            if os.path.exists(file_path):
-                                with open(file_path, 'r', encoding='utf-8') as f:
-                                    content = f.read().encode('utf-8')
-                                
-                                fixed_content = self._fix_css_content(content)
-                                
-                                with open(file_path, 'wb') as f:
-                                    f.write(fixed_content)
-                                
-                                file_found = True
-                                break
+            # 先在目标文件所在目录写入临时文件，完成后原子替换目标文件，
+            # 处理失败时原文件保持不变
+            tmp_out = f"{output_path}.tmp.{os.getpid()}"
+            
+            # 较小的文件整体读入内存，之后按条目随机读取时不再反复访问磁盘
+            if os.path.getsize(input_path) < _IN_MEMORY_LIMIT:
+                with open(input_path, 'rb') as f:
+                    source = io.BytesIO(f.read())
+            else:
+                source = input_path
+            
+            with zipfile.ZipFile(source, 'r') as zip_in:
+                infos = zip_in.infolist()
+                names = [info.filename for info in infos]
                 
-                # 添加全局修复CSS文件
-                for prefix in ['EPUB/', 'OEBPS/', '']:
-                    style_dir = os.path.join(temp_dir, prefix, 'style')
-                    if os.path.exists(style_dir):
-                        fix_css_path = os.path.join(style_dir, 'epub_fixer.css')
-                        with open(fix_css_path, 'w', encoding='utf-8') as f:
-                            f.write(self._get_fix_css())
-                        break
+                # 解析OPF清单，直接得到HTML和CSS文件在压缩包中的路径
+                opf_name = self._find_opf_name(zip_in)
+                if not opf_name:
+                    raise ValueError("未找到OPF文件")
+                manifest = self._read_manifest(opf_name, zip_in.read(opf_name))
+                name_set = set(names)
+                for name in sorted(manifest):
+                    if manifest[name] == _ITEM_DOCUMENT and name not in name_set:
+                        print(f"警告: 未找到文件 {name}")
                 
-                # 修复页面翻页方向（修改OPF文件）
-                self._fix_opf_direction(temp_dir)
+                # 内容根目录即OPF所在目录，全局修复CSS文件优先放在其中已有的style目录下
+                content_root = posixpath.dirname(opf_name)
+                style_dir = posixpath.join(content_root, 'style', '')
+                if any(name.startswith(style_dir) for name in names):
+                    fix_css_name = style_dir + _FIX_CSS_FILENAME
+                else:
+                    fix_css_name = posixpath.join(content_root, _FIX_CSS_FILENAME)
                 
-                # 重新打包EPUB
-                with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+                # 使用大缓冲区写出，减少小块write系统调用
+                with open(tmp_out, 'wb', buffering=_COPY_BUFSIZE) as raw_out, \
+                        zipfile.ZipFile(raw_out, 'w', zipfile.ZIP_DEFLATED,
+                                        compresslevel=compresslevel) as zip_out:
                     # 首先添加mimetype文件（必须不压缩且首先添加）
-                    mimetype_path = os.path.join(temp_dir, 'mimetype')
-                    if os.path.exists(mimetype_path):
-                        zip_out.write(mimetype_path, 'mimetype', compress_type=zipfile.ZIP_STORED)
+                    if 'mimetype' in names:
+                        zip_out.writestr('mimetype', zip_in.read('mimetype'),
+                                         compress_type=zipfile.ZIP_STORED)
+                    
+                    # 逐个复制其他条目，只解码并修复HTML/CSS/OPF
+                    css_hrefs = {}
+                    for info in infos:
+                        name = info.filename
+                        if info.is_dir() or name == 'mimetype' or name == fix_css_name:
+                            continue
+                        
+                        out_info = zipfile.ZipInfo(name, date_time=info.date_time)
+                        out_info.external_attr = info.external_attr
+                        # 原本未压缩的条目保持原样，已压缩的媒体文件不再重复deflate
+                        if (info.compress_type == zipfile.ZIP_STORED
+                                or name.lower().endswith(_STORED_EXTENSIONS)):
+                            out_info.compress_type = zipfile.ZIP_STORED
+                        else:
+                            out_info.compress_type = zipfile.ZIP_DEFLATED
+                        # ZipFile.open只使用ZipInfo自身的压缩级别
+                        out_info._compresslevel = compresslevel
+                        
+                        item_type = manifest.get(name)
+                        if item_type == _ITEM_DOCUMENT:
+                            # 同一目录下的文档共用同一个相对链接
+                            doc_dir = posixpath.dirname(name)
+                            css_href = css_hrefs.get(doc_dir)
+                            if css_href is None:
+                                css_href = quote(posixpath.relpath(fix_css_name, doc_dir))
+                                css_hrefs[doc_dir] = css_href
+                            content = self._fix_html_content(zip_in.read(info), css_href)
+                        elif item_type == _ITEM_STYLE:
+                            content = self._fix_css_content(zip_in.read(info))
+                        elif name == opf_name:
+                            # 修复页面翻页方向，并在清单中登记全局修复CSS文件
+                            fix_css_href = quote(posixpath.relpath(fix_css_name, content_root or '.'))
+                            content = self._fix_opf_content(zip_in.read(info), fix_css_href)
+                        else:
+                            # 图片、字体等无需修改的条目分块流式复制，不整体读入内存
+                            out_info.file_size = info.file_size
+                            with zip_in.open(info) as src, zip_out.open(out_info, 'w') as dst:
+                                shutil.copyfileobj(src, dst, _COPY_BUFSIZE)
+                            continue
+                        
+                        zip_out.writestr(out_info, content)
                     
-                    # 添加其他所有文件
-                    for root, dirs, files in os.walk(temp_dir):
-                        for file in files:
-                            if file == 'mimetype':
-                                continue
-                            file_path = os.path.join(root, file)
-                            arc_name = os.path.relpath(file_path, temp_dir)
-                            zip_out.write(file_path, arc_name)
+                    # 添加全局修复CSS文件
+                    zip_out.writestr(fix_css_name, _FIX_CSS_BYTES)
+            
+            os.replace(tmp_out, output_path)
             
             self.processed_files += 1
             return True
             
         except Exception as e:
             print(f"修复文件 {input_path} 时出错: {str(e)}")
-            import traceback
             traceback.print_exc()
+            if tmp_out and os.path.exists(tmp_out):
+                os.remove(tmp_out)
             return False
     
-    def _fix_html_content(self, content: bytes) -> bytes:
+    def _fix_html_content(self, content: bytes, css_href: str = _FIX_CSS_FILENAME) -> bytes:
         """
         修复HTML内容中的排版和字体问题
         
         Args:
             content: 原始HTML内容
+            css_href: 从该文档指向全局修复CSS文件的相对链接
             
         Returns:
             bytes: 修复后的HTML内容
         """
         try:
-            # 使用XML解析器以更好地保留XHTML结构，避免无意更改标签属性（如img尺寸）
-            soup = BeautifulSoup(content, 'xml')
-            
-            # 修复body标签的writing-mode
-            body = soup.find('body')
-            if body:
-                # 移除可能导致竖排的样式
-                if body.get('style'):
-                    style = body.get('style', '')
-                    style = self._fix_style_attribute(style)
-                    body['style'] = style
-            
-            # 修复所有标签的style属性
-            for tag in soup.find_all(style=True):
-                # 避免修改<img>的尺寸样式，保持原有显示
-                if getattr(tag, 'name', '').lower() == 'img':
-                    continue
-                style = tag.get('style', '')
-                fixed_style = self._fix_style_attribute(style)
-                tag['style'] = fixed_style
-            
-            # 在head中添加修复样式
-            head = soup.find('head')
-            if head:
-                # 检查是否已经存在修复样式
-                existing_style = head.find('style', id='epub-fixer-style')
-                if not existing_style:
-                    style_tag = soup.new_tag('style')
-                    style_tag['id'] = 'epub-fixer-style'
-                    style_tag.string = self._get_fix_css()
-                    head.append(style_tag)
-            
-            return str(soup).encode('utf-8')
+            fixed_content = self._fix_html_content_fast(content, css_href)
+            if fixed_content is None:
+                # 正则无法安全处理的文档，退回到完整解析
+                fixed_content = self._fix_html_content_tree(content, css_href)
+            return fixed_content
             
         except Exception as e:
             print(f"修复HTML内容时出错: {str(e)}")
             return content
     
+    def _fix_html_content_fast(self, content: bytes, css_href: str) -> Optional[bytes]:
+        """
+        使用正则直接修复HTML内容，不构建文档树，其余字节保持原样
+        
+        Args:
+            content: 原始HTML内容
+            css_href: 从该文档指向全局修复CSS文件的相对链接
+            
+        Returns:
+            Optional[bytes]: 修复后的HTML内容；文档中存在正则无法安全处理的结构时为None
+        """
+        # 不含竖排/上划线相关关键字的文档无需改写style属性，只需引用修复样式
+        has_markers = _FIX_MARKER_RE.search(content) is not None
+        # 非双引号的style属性、自闭合的head、head之前的注释或脚本等情况交给完整解析处理
+        if has_markers and _UNQUOTED_STYLE_ATTR_RE.search(content):
+            return None
+        head_close = _HEAD_CLOSE_RE.search(content)
+        if head_close is None:
+            if _HEAD_OPEN_RE.search(content):
+                return None
+        elif _HEAD_UNSAFE_RE.search(content, 0, head_close.start()):
+            return None
+        
+        def fix_tag(match):
+            # 避免修改<img>的尺寸样式，保持原有显示
+            if match.group(1).lower() == b'img':
+                return match.group(0)
+            style = match.group(2).decode('utf-8', 'surrogateescape')
+            fixed_style = self._fix_style_attribute(style).encode('utf-8', 'surrogateescape')
+            start, end = match.span(2)
+            offset = match.start()
+            tag = match.group(0)
+            return tag[:start - offset] + fixed_style + tag[end - offset:]
+        
+        if has_markers:
+            content = _STYLED_TAG_RE.sub(fix_tag, content)
+        
+        # 在head中引用修复样式（已存在时不重复添加）
+        if head_close is not None and _FIX_STYLE_ID not in content:
+            link = _fix_css_link(css_href)
+            content = _HEAD_CLOSE_RE.sub(lambda m: link + m.group(0), content, count=1)
+        
+        return content
+    
+    def _fix_html_content_tree(self, content: bytes, css_href: str) -> bytes:
+        """
+        解析完整文档树后修复HTML内容
+        
+        Args:
+            content: 原始HTML内容
+            css_href: 从该文档指向全局修复CSS文件的相对链接
+            
+        Returns:
+            bytes: 修复后的HTML内容
+        """
+        content = _UNQUOTED_STYLE_VALUE_RE.sub(rb'\1"\2"', content)
+        # 使用XML解析器以更好地保留XHTML结构，避免无意更改标签属性（如img尺寸）
+        root = etree.fromstring(content, _XHTML_PARSER)
+        if root is None:
+            raise ValueError("无法解析HTML文档")
+        
+        # 修复所有标签（含body）的style属性，由预编译XPath在C层筛选
+        for tag in _STYLED_XPATH(root):
+            # 避免修改<img>的尺寸样式，保持原有显示
+            if etree.QName(tag).localname.lower() == 'img':
+                continue
+            tag.set('style', self._fix_style_attribute(tag.get('style')))
+        
+        # 在head中引用修复样式
+        heads = _HEAD_XPATH(root)
+        if heads:
+            head = heads[0]
+            # 检查是否已经存在修复样式
+            existing_style = head.find(".//*[@id='epub-fixer-style']")
+            if existing_style is None:
+                namespace = etree.QName(head).namespace
+                etree.SubElement(head, f"{{{namespace}}}link" if namespace else 'link',
+                                 {'href': css_href, **_FIX_LINK_ATTRIB})
+        
+        return etree.tostring(root.getroottree(), encoding='utf-8', xml_declaration=True)
+    
     def _fix_style_attribute(self, style: str) -> str:
         """
         修复style属性中的排版问题
@@ -187,44 +396,7 @@ class EPUBFixer:
         Returns:
             str: 修复后的style字符串
         """
-        # 移除竖排相关的样式
-        style_rules = [s.strip() for s in style.split(';') if s.strip()]
-        fixed_rules = []
-        
-        for rule in style_rules:
-            rl = rule.lower()
-            # 仅当明确为竖排取值时才修复writing-mode，避免误伤
-            if 'writing-mode' in rl:
-                # 提取属性值进行判断
-                # 简单拆分，不做复杂CSS解析
-                if ':' in rl:
-                    prop, val = [s.strip() for s in rl.split(':', 1)]
-                else:
-                    prop, val = rl, ''
-                if any(v in val for v in ['vertical-rl', 'vertical-lr', 'tb-rl', 'tb-lr']):
-                    fixed_rules.append('writing-mode: horizontal-tb')
-                    continue
-            
-            # 移除text-orientation（与竖排相关）
-            if 'text-orientation' in rl:
-                continue
-            
-            # 移除-webkit-writing-mode / -epub-writing-mode 的竖排设置
-            if '-webkit-writing-mode' in rl or '-epub-writing-mode' in rl:
-                if any(v in rl for v in ['vertical-rl', 'vertical-lr', 'tb-rl', 'tb-lr', 'vertical']):
-                    continue
-            
-            # 修复text-decoration中包含overline的情况，改为underline（保留其他取值）
-            if 'text-decoration' in rl and 'overline' in rl:
-                if ':' in rule:
-                    prop_raw, val_raw = rule.split(':', 1)
-                    new_val = val_raw.replace('overline', 'underline')
-                    fixed_rules.append(f"{prop_raw.strip()}: {new_val.strip()}")
-                    continue
-            
-            fixed_rules.append(rule)
-        
-        return '; '.join(fixed_rules)
+        return _fix_style(style)
     
     def _fix_css_content(self, content: bytes) -> bytes:
         """
@@ -237,45 +409,11 @@ class EPUBFixer:
             bytes: 修复后的CSS内容
         """
         try:
-            css_text = content.decode('utf-8')
+            # 不含竖排/上划线相关关键字的样式表原样返回
+            if not _FIX_MARKER_RE.search(content):
+                return content
             
-            # 修复writing-mode相关的CSS规则
-            lines = css_text.split('\n')
-            fixed_lines = []
-            
-            for line in lines:
-                line_lower = line.lower()
-                
-                # 替换竖排为横排
-                if 'writing-mode' in line_lower and ('vertical-rl' in line_lower or 'vertical-lr' in line_lower or 'tb-rl' in line_lower or 'tb-lr' in line_lower):
-                    fixed_lines.append(line.replace('vertical-rl', 'horizontal-tb')
-                                          .replace('vertical-lr', 'horizontal-tb')
-                                          .replace('tb-rl', 'horizontal-tb')
-                                          .replace('tb-lr', 'horizontal-tb'))
-                    continue
-                
-                # 注释掉text-orientation
-                if 'text-orientation' in line_lower:
-                    fixed_lines.append('/* ' + line + ' */')
-                    continue
-                
-                # 注释掉-webkit-writing-mode和-epub-writing-mode如果是竖排
-                if ('-webkit-writing-mode' in line_lower or '-epub-writing-mode' in line_lower):
-                    if 'vertical' in line_lower:
-                        fixed_lines.append('/* ' + line + ' */')
-                        continue
-                
-                # 修复目录链接可能被设置为上划线的情况：将overline改为underline
-                if 'text-decoration' in line_lower and 'overline' in line_lower:
-                    fixed_lines.append(line.replace('overline', 'underline'))
-                    continue
-                if 'text-decoration-line' in line_lower and 'overline' in line_lower:
-                    fixed_lines.append(line.replace('overline', 'underline'))
-                    continue
-                
-                fixed_lines.append(line)
-            
-            return '\n'.join(fixed_lines).encode('utf-8')
+            return _CSS_FIX_RE.sub(_fix_css_declaration, content)
             
         except Exception as e:
             print(f"修复CSS内容时出错: {str(e)}")
@@ -330,46 +468,108 @@ class EPUBFixer:
             # 如果没有direction属性，设置为LTR
             book.direction = 'ltr'
     
-    def _fix_opf_direction(self, epub_dir: str):
+    def _find_opf_name(self, zip_in: zipfile.ZipFile) -> Optional[str]:
         """
-        修复OPF文件中的页面翻页方向
+        查找OPF文件：按EPUB规范读取META-INF/container.xml中rootfile的full-path
         
         Args:
-            epub_dir: EPUB解压目录
+            zip_in: 已打开的EPUB压缩包
+            
+        Returns:
+            Optional[str]: OPF文件的条目名，未找到时为None
         """
-        import xml.etree.ElementTree as ET
+        names = zip_in.namelist()
+        if _CONTAINER_NAME in names:
+            try:
+                container = etree.fromstring(zip_in.read(_CONTAINER_NAME))
+                for full_path in _ROOTFILE_PATH_XPATH(container):
+                    if full_path in names:
+                        return full_path
+            except etree.XMLSyntaxError as e:
+                print(f"解析{_CONTAINER_NAME}时出错: {str(e)}")
         
-        # 查找OPF文件
-        opf_path = None
+        # container.xml缺失或无效时，退回到在常见目录中查找
         for prefix in ['EPUB/', 'OEBPS/', '']:
-            for file in os.listdir(os.path.join(epub_dir, prefix)) if os.path.exists(os.path.join(epub_dir, prefix)) else []:
-                if file.endswith('.opf'):
-                    opf_path = os.path.join(epub_dir, prefix, file)
-                    break
-            if opf_path:
-                break
+            for name in names:
+                if name.startswith(prefix) and '/' not in name[len(prefix):] and name.endswith('.opf'):
+                    return name
+        return None
+    
+    def _read_manifest(self, opf_name: str, opf_content: bytes) -> Dict[str, str]:
+        """
+        解析OPF清单，获取HTML文档和CSS样式表在压缩包中的路径
+        
+        Args:
+            opf_name: OPF文件的条目名
+            opf_content: OPF文件内容
+            
+        Returns:
+            dict: 条目名到类型（_ITEM_DOCUMENT或_ITEM_STYLE）的映射
+        """
+        opf_dir = posixpath.dirname(opf_name)
         
-        if not opf_path:
-            return
+        # 只需要清单条目的属性，流式解析并及时释放已处理的元素，不保留整棵文档树
+        manifest = {}
+        for _, item in etree.iterparse(io.BytesIO(opf_content), events=('end',),
+                                       tag=_OPF_ITEM_TAG):
+            href = item.get('href')
+            media_type = item.get('media-type', '')
+            item.clear()
+            if not href:
+                continue
+            # href相对于OPF所在目录，且可能经过URL编码
+            name = posixpath.normpath(posixpath.join(opf_dir, unquote(href)))
+            if media_type in _HTML_MEDIA_TYPES:
+                manifest[name] = _ITEM_DOCUMENT
+            elif media_type == _CSS_MEDIA_TYPE:
+                manifest[name] = _ITEM_STYLE
+        
+        return manifest
+    
+    def _fix_opf_content(self, content: bytes, fix_css_href: str) -> bytes:
+        """
+        修复OPF文件中的页面翻页方向，并在清单中登记全局修复CSS文件
         
+        Args:
+            content: 原始OPF内容
+            fix_css_href: 全局修复CSS文件相对于OPF的链接
+            
+        Returns:
+            bytes: 修复后的OPF内容
+        """
         try:
             # 解析OPF文件
-            tree = ET.parse(opf_path)
-            root = tree.getroot()
-            
-            # 查找spine元素
-            ns = {'opf': 'http://www.idpf.org/2007/opf'}
-            spine = root.find('.//opf:spine', ns)
+            root = etree.fromstring(content)
             
-            if spine is not None:
-                # 修改page-progression-direction属性
+            # 修改spine的page-progression-direction属性
+            for spine in _SPINE_XPATH(root):
                 if spine.get('page-progression-direction') == 'rtl':
                     spine.set('page-progression-direction', 'ltr')
             
-            # 保存修改后的OPF文件
-            tree.write(opf_path, encoding='utf-8', xml_declaration=True)
+            # 登记全局修复CSS文件（已登记时跳过）
+            manifest = _MANIFEST_XPATH(root)
+            items = _MANIFEST_ITEMS_XPATH(root)
+            if manifest and not any(unquote(item.get('href', '')) == unquote(fix_css_href) for item in items):
+                ids = {item.get('id') for item in items}
+                item_id = _FIX_CSS_ITEM_ID
+                suffix = 1
+                while item_id in ids:
+                    suffix += 1
+                    item_id = f"{_FIX_CSS_ITEM_ID}-{suffix}"
+                item = etree.Element(f"{{{_OPF_NAMESPACES['opf']}}}item")
+                # 沿用已有条目的缩进
+                if len(manifest[0]):
+                    item.tail = manifest[0][-1].tail
+                    manifest[0][-1].tail = manifest[0].text
+                manifest[0].append(item)
+                item.set('id', item_id)
+                item.set('href', fix_css_href)
+                item.set('media-type', _CSS_MEDIA_TYPE)
+            
+            return etree.tostring(root.getroottree(), encoding='utf-8', xml_declaration=True)
         except Exception as e:
             print(f"修复OPF文件时出错: {str(e)}")
+            return content
     
     def _get_fix_css(self) -> str:
         """
@@ -378,49 +578,18 @@ class EPUBFixer:
         Returns:
             str: CSS规则字符串
         """
-        return """
-/* EPUB格式修复样式 */
-body {
-    writing-mode: horizontal-tb !important;
-    -webkit-writing-mode: horizontal-tb !important;
-    -epub-writing-mode: horizontal-tb !important;
-    direction: ltr;
-}
-
-/* 确保中文字体正确显示 */
-body, p, div, span {
-    font-family: "Microsoft YaHei", "SimSun", "PingFang SC", "Noto Sans CJK SC", sans-serif;
-}
-
-/* 目录页链接统一使用下划线，避免出现上划线 */
-/* 常见目录页class: body.p-toc, .p-toc, .toc */
-body.p-toc a,
-.p-toc a,
-.toc a,
-body[class*="toc"] a {
-    text-decoration-line: underline !important;
-    text-decoration-thickness: auto;
-    text-underline-position: under !important;
-    text-decoration-skip-ink: auto;
-    border-top: none !important; /* 避免使用边框制造上划线 */
-}
-
-/* 如果有显式的overline声明，强制改为underline */
-a[style*="overline"],
-body.p-toc a[style],
-.p-toc a[style],
-.toc a[style] {
-    text-decoration-line: underline !important;
-}
-"""
+        return _FIX_CSS
     
-    def batch_fix(self, input_paths: List[str], output_dir: Optional[str] = None) -> dict:
+    def batch_fix(self, input_paths: List[str], output_dir: Optional[str] = None,
+                  max_workers: Optional[int] = None, fast: bool = False) -> dict:
         """
         批量修复EPUB文件
         
         Args:
             input_paths: 输入EPUB文件路径列表
             output_dir: 输出目录，如果为None则覆盖原文件
+            max_workers: 并行工作进程数，如果为None则使用CPU核心数
+            fast: 是否使用最快的压缩级别（输出稍大）
             
         Returns:
             dict: 包含成功和失败统计的字典
@@ -428,20 +597,54 @@ body.p-toc a[style],
         self.total_files = len(input_paths)
         self.processed_files = 0
         
-        success_count = 0
-        failed_files = []
-        
+        jobs = []
         for input_path in input_paths:
             if output_dir:
                 filename = os.path.basename(input_path)
                 output_path = os.path.join(output_dir, filename)
             else:
                 output_path = None
-            
-            if self.fix_epub(input_path, output_path):
-                success_count += 1
-            else:
-                failed_files.append(input_path)
+            jobs.append((input_path, output_path))
+        
+        results = {}
+        
+        def record(input_path, success):
+            results[input_path] = success
+            self.processed_files += 1
+            self.current_file = os.path.basename(input_path)
+        
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if sys.platform == 'win32':
+            max_workers = min(max_workers, _WINDOWS_MAX_WORKERS)
+        max_workers = max(1, min(max_workers, len(jobs)))
+        
+        if max_workers == 1:
+            # 只有一个文件或只允许一个进程时直接在当前进程处理，省去启动进程池的开销
+            for input_path, output_path in jobs:
+                try:
+                    success = _fix_one(input_path, output_path, fast)
+                except Exception as e:
+                    print(f"修复文件 {input_path} 时出错: {str(e)}")
+                    success = False
+                record(input_path, success)
+        else:
+            # 每个文件相互独立，使用多进程并行处理以绕过GIL
+            # GUI会在后台线程中调用本方法，多线程进程中fork不安全，统一使用spawn启动工作进程
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = {executor.submit(_fix_one, ip, op, fast): ip for ip, op in jobs}
+                for future in as_completed(futures):
+                    input_path = futures[future]
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        print(f"修复文件 {input_path} 时出错: {str(e)}")
+                        success = False
+                    record(input_path, success)
+        
+        failed_files = [ip for ip, _ in jobs if not results[ip]]
+        success_count = len(jobs) - len(failed_files)
         
         return {
             'total': self.total_files,
@@ -458,3 +661,89 @@ body.p-toc a[style],
             tuple: (已处理数量, 总数量, 当前文件名)
         """
         return (self.processed_files, self.total_files, self.current_file)
+
+
+@functools.lru_cache(maxsize=64)
+def _fix_css_link(css_href: str) -> bytes:
+    """
+    生成引用全局修复CSS文件的link标签，相同链接只生成一次
+    
+    Args:
+        css_href: 指向全局修复CSS文件的相对链接
+        
+    Returns:
+        bytes: link标签
+    """
+    return _FIX_LINK_TEMPLATE % css_href.encode('utf-8')
+
+
+@functools.lru_cache(maxsize=8192)
+def _fix_style(style: str) -> str:
+    """
+    修复style属性字符串；同一本书中的内联样式大量重复，结果按原字符串缓存
+    
+    Args:
+        style: 原始style字符串
+        
+    Returns:
+        str: 修复后的style字符串
+    """
+    return _STYLE_FIX_RE.sub(_fix_style_declaration, style).strip()
+
+
+def _fix_style_declaration(match: re.Match) -> str:
+    """
+    替换_STYLE_FIX_RE匹配到的单条style声明
+    
+    Args:
+        match: _STYLE_FIX_RE的匹配结果
+        
+    Returns:
+        str: 替换后的声明
+    """
+    kind = match.lastgroup
+    if kind == 'vertical':
+        return 'writing-mode: horizontal-tb'
+    if kind == 'drop':
+        return ''
+    return match.group('overline') + 'underline'
+
+
+def _fix_css_declaration(match: re.Match) -> bytes:
+    """
+    替换_CSS_FIX_RE匹配到的单条CSS声明
+    
+    Args:
+        match: _CSS_FIX_RE的匹配结果
+        
+    Returns:
+        bytes: 替换后的声明
+    """
+    kind = match.lastgroup
+    if kind == 'vertical':
+        return match.group('vertical') + b'horizontal-tb'
+    if kind == 'comment':
+        return b'/* ' + match.group(0) + b' */'
+    return match.group('overline') + b'underline'
+
+
+# 每个工作进程复用的修复器实例，由_fix_one在首次调用时创建
+_worker_fixer: Optional[EPUBFixer] = None
+
+
+def _fix_one(input_path: str, output_path: Optional[str], fast: bool = False) -> bool:
+    """
+    在工作进程中修复单个EPUB文件（供批量处理使用）
+    
+    Args:
+        input_path: 输入EPUB文件路径
+        output_path: 输出EPUB文件路径，如果为None则覆盖原文件
+        fast: 是否使用最快的压缩级别
+        
+    Returns:
+        bool: 修复是否成功
+    """
+    global _worker_fixer
+    if _worker_fixer is None:
+        _worker_fixer = EPUBFixer()
+    return _worker_fixer.fix_epub(input_path, output_path, fast)
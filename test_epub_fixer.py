@@ -4,43 +4,20 @@
 测试EPUB修复功能
 """
 
+import io
 import os
-import tempfile
+import zipfile
+import pytest
+from bs4 import BeautifulSoup
+from lxml import etree
 from epub_fixer import EPUBFixer
 
 
-def test_style_fixing():
-    """测试样式修复功能"""
-    fixer = EPUBFixer()
-    
-    # 测试竖排样式修复
-    vertical_style = "writing-mode: vertical-rl; font-size: 14px; color: black;"
-    fixed_style = fixer._fix_style_attribute(vertical_style)
-    assert "horizontal-tb" in fixed_style
-    assert "vertical" not in fixed_style
-    print("✓ 竖排样式修复测试通过")
-    
-    # 测试text-orientation移除
-    orientation_style = "text-orientation: upright; font-size: 14px;"
-    fixed_style = fixer._fix_style_attribute(orientation_style)
-    assert "text-orientation" not in fixed_style
-    assert "font-size" in fixed_style
-    print("✓ text-orientation移除测试通过")
-    
-    # 测试-webkit-writing-mode移除
-    webkit_style = "-webkit-writing-mode: vertical-rl; margin: 10px;"
-    fixed_style = fixer._fix_style_attribute(webkit_style)
-    assert "-webkit-writing-mode" not in fixed_style
-    assert "margin" in fixed_style
-    print("✓ webkit样式移除测试通过")
-
+# 各测试共用的修复器实例
+_FIXER = EPUBFixer()
 
-def test_css_fixing():
-    """测试CSS修复功能"""
-    fixer = EPUBFixer()
-    
-    # 测试CSS中竖排样式修复
-    css_content = """
+# 含竖排样式的CSS样例
+_CSS_FIXTURE = b"""
 body {
     writing-mode: vertical-rl;
     font-size: 16px;
@@ -50,166 +27,292 @@ body {
     writing-mode: tb-rl;
 }
 """
-    fixed_css = fixer._fix_css_content(css_content.encode('utf-8')).decode('utf-8')
-    assert "horizontal-tb" in fixed_css
-    assert "vertical-rl" not in fixed_css
-    print("✓ CSS竖排样式修复测试通过")
 
-
-def test_html_fixing():
-    """测试HTML修复功能"""
-    fixer = EPUBFixer()
-    
-    # 测试HTML修复
-    html_content = """
+# 含竖排样式的HTML样例
+_HTML_FIXTURE = """
 <html>
 <head><title>Test</title></head>
 <body style="writing-mode: vertical-rl;">
     <p style="text-orientation: upright;">测试文本</p>
 </body>
 </html>
+""".encode('utf-8')
+
+# 含RTL翻页方向的OPF样例
+_OPF_FIXTURE = b"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">test</dc:identifier>
+  </metadata>
+  <manifest>
+    <item id="ch1" href="ch1.xhtml" media-type="application/xhtml+xml"/>
+    <item id="css" href="style/main.css" media-type="text/css"/>
+  </manifest>
+  <spine page-progression-direction="rtl">
+    <itemref idref="ch1"/>
+  </spine>
+</package>
 """
-    fixed_html = fixer._fix_html_content(html_content.encode('utf-8')).decode('utf-8')
-    assert "horizontal-tb" in fixed_html
-    assert "epub-fixer-style" in fixed_html
-    print("✓ HTML修复测试通过")
+_OPF_NS = {'opf': 'http://www.idpf.org/2007/opf'}
+
+# META-INF/container.xml样例，指向OEBPS/content.opf
+_CONTAINER_FIXTURE = b"""<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+# 带有外部CSS链接和图片的XHTML样例
+_HTML_WITH_LINK = '''<?xml version="1.0"?>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+    <title>Test</title>
+    <link href="style/style.css" rel="stylesheet" type="text/css"/>
+</head>
+<body style="writing-mode: vertical-rl;">
+    <p>测试文本</p>
+    <img src="test.png" alt="图片"/>
+</body>
+</html>'''.encode('utf-8')
+
+# 带有SVG图片的XHTML样例
+_HTML_WITH_SVG = '''<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"
+  "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="ja" class="calibre">
+<head>
+    <title>Test with SVG</title>
+    <meta name="viewport" content="width=1090, height=2048"/>
+</head>
+<body class="calibre1">
+<div class="main">
+<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" width="100%" height="100%" viewBox="0 0 1090 2048">
+<image width="1090" height="2048" xlink:href="../images/00004.jpeg"/>
+</svg>
+</div>
+</body>
+</html>'''.encode('utf-8')
+
+
+def _write_epub(path, files, container=_CONTAINER_FIXTURE):
+    """
+    写出测试用EPUB文件
+    
+    Args:
+        path: 输出路径或可写的文件对象
+        files: 条目名到内容的映射
+        container: META-INF/container.xml的内容，为None时不写入
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('mimetype', b'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        if container is not None:
+            zip_file.writestr('META-INF/container.xml', container)
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+
+
+@pytest.mark.parametrize('style, removed, kept', [
+    # 竖排样式修复为横排
+    ("writing-mode: vertical-rl; font-size: 14px; color: black;", "vertical", "horizontal-tb"),
+    # text-orientation移除
+    ("text-orientation: upright; font-size: 14px;", "text-orientation", "font-size"),
+    # -webkit-writing-mode移除
+    ("-webkit-writing-mode: vertical-rl; margin: 10px;", "-webkit-writing-mode", "margin"),
+    # 带前缀的text-orientation移除
+    ("-webkit-text-orientation: upright; font-size: 14px;", "text-orientation", "font-size"),
+    ("-epub-text-orientation: upright; margin: 10px;", "text-orientation", "margin"),
+])
+def test_style_fixing(style, removed, kept):
+    """测试样式修复功能"""
+    fixed_style = _FIXER._fix_style_attribute(style)
+    assert removed not in fixed_style
+    assert kept in fixed_style
+
+
+def test_css_fixing():
+    """测试CSS修复功能"""
+    fixer = _FIXER
+    
+    # 测试CSS中竖排样式修复
+    fixed_css = fixer._fix_css_content(_CSS_FIXTURE)
+    assert b"horizontal-tb" in fixed_css
+    assert b"vertical-rl" not in fixed_css
+
+
+def test_css_fixing_prefixed_orientation():
+    """测试带前缀的text-orientation整条注释掉，且同一行的其他声明不受影响"""
+    css = (b'p { -epub-text-orientation: upright; font-size: 2em; }\n'
+           b'h1 { -webkit-text-orientation: mixed; text-decoration: overline; }\n')
+    fixed_css = _FIXER._fix_css_content(css)
+    assert b'/* -epub-text-orientation: upright; */ font-size: 2em;' in fixed_css
+    assert b'/* -webkit-text-orientation: mixed; */' in fixed_css
+    assert b'text-decoration: underline;' in fixed_css
+    assert b'overline' not in fixed_css
+    # 重复修复不应再次注释
+    assert _FIXER._fix_css_content(fixed_css) == fixed_css
+
+
+def test_html_fixing():
+    """测试HTML修复功能"""
+    fixer = _FIXER
+    
+    # 测试HTML修复
+    fixed_html = fixer._fix_html_content(_HTML_FIXTURE)
+    assert b"horizontal-tb" in fixed_html
+    assert b"epub-fixer-style" in fixed_html
+
+
+def test_html_fixing_quoted_angle_bracket():
+    """测试style之前的属性值中含有">"时仍能修复竖排样式"""
+    html = (b'<html><head><title>Test</title></head><body>'
+            b'<p title="a > b" style="writing-mode: vertical-rl">x</p>'
+            b"<p title='c > d' style=\"writing-mode: vertical-rl\">y</p>"
+            b'</body></html>')
+    fixed_html = _FIXER._fix_html_content(html)
+    assert b"vertical-rl" not in fixed_html
+    assert fixed_html.count(b"writing-mode: horizontal-tb") == 2
+    assert b'title="a > b"' in fixed_html
+
+
+@pytest.mark.parametrize('html', [
+    # head中的注释含有</head>字样
+    b'<html><head><!-- old </head> --><title>Test</title></head>'
+    b'<body style="writing-mode: vertical-rl"><p>x</p></body></html>',
+    # head中的脚本含有</head>字样
+    b'<html><head><script><![CDATA[var s = "</head>";]]></script><title>Test</title></head>'
+    b'<body style="writing-mode: vertical-rl"><p>x</p></body></html>',
+])
+def test_html_fixing_head_close_in_comment(html):
+    """测试注释或脚本中的</head>字样不会被当作插入修复样式的位置"""
+    assert _FIXER._fix_html_content_fast(html, 'epub_fixer.css') is None
+    fixed_html = _FIXER._fix_html_content(html)
+    assert fixed_html.count(b'id="epub-fixer-style"') == 1
+    # 修复样式位于真正的head中，而不是注释或脚本里
+    root = etree.fromstring(fixed_html)
+    head = root.find('head')
+    assert head.find("link[@id='epub-fixer-style']") is not None
+    assert b'horizontal-tb' in fixed_html
+
+
+@pytest.mark.parametrize('html', [
+    # 单引号style属性
+    b"<html><head><title>Test</title></head><body>"
+    b"<p style='writing-mode: vertical-rl'>x</p></body></html>",
+    # 无引号style属性
+    b'<html><head><title>Test</title></head><body>'
+    b'<p style=writing-mode:vertical-rl>x</p></body></html>',
+    # 自闭合的<head/>
+    b'<html xmlns="http://www.w3.org/1999/xhtml"><head/>'
+    b'<body style="writing-mode: vertical-rl"><p>x</p></body></html>',
+])
+def test_html_fixing_tree_fallback(html):
+    """测试快速路径无法处理的文档回退到解析文档树后仍能正确修复"""
+    assert _FIXER._fix_html_content_fast(html, 'epub_fixer.css') is None
+    fixed_html = _FIXER._fix_html_content(html)
+    assert b"vertical-rl" not in fixed_html
+    assert b"horizontal-tb" in fixed_html
+    assert fixed_html.count(b'id="epub-fixer-style"') == 1
+    assert b'>x</p>' in fixed_html
 
 
 def test_fix_css_generation():
     """测试修复CSS生成"""
-    fixer = EPUBFixer()
+    fixer = _FIXER
     css = fixer._get_fix_css()
     assert "horizontal-tb" in css
     assert "font-family" in css
-    print("✓ 修复CSS生成测试通过")
 
 
 def test_progress_tracking():
     """测试进度跟踪"""
-    fixer = EPUBFixer()
+    fixer = _FIXER
     fixer.total_files = 10
     fixer.processed_files = 5
     fixer.current_file = "test.epub"
     
-    progress = fixer.get_progress()
-    assert progress[0] == 5
-    assert progress[1] == 10
-    assert progress[2] == "test.epub"
-    print("✓ 进度跟踪测试通过")
+    try:
+        progress = fixer.get_progress()
+        assert progress[0] == 5
+        assert progress[1] == 10
+        assert progress[2] == "test.epub"
+    finally:
+        # 恢复共用实例的初始状态，避免影响其他测试
+        fixer.total_files = 0
+        fixer.processed_files = 0
+        fixer.current_file = ""
 
 
-def test_page_progression_direction():
-    """测试页面翻页方向修复"""
-    from ebooklib import epub
-    
-    fixer = EPUBFixer()
-    
+@pytest.mark.parametrize('direction', ['rtl', 'ltr', None])
+def test_page_progression_direction(direction):
+    """测试页面翻页方向修复：RTL和未设置都改为LTR，LTR保持不变"""
     # 模拟一个book对象来测试方向修复
     class MockBook:
         def __init__(self, direction):
             self.direction = direction
     
-    # 测试RTL改为LTR
-    book_rtl = MockBook('rtl')
-    fixer._fix_page_progression_direction(book_rtl)
-    assert book_rtl.direction == 'ltr'
-    print("✓ RTL改为LTR测试通过")
-    
-    # 测试LTR保持LTR
-    book_ltr = MockBook('ltr')
-    fixer._fix_page_progression_direction(book_ltr)
-    assert book_ltr.direction == 'ltr'
-    print("✓ LTR保持不变测试通过")
-    
-    # 测试None改为LTR
-    book_none = MockBook(None)
-    fixer._fix_page_progression_direction(book_none)
-    assert book_none.direction == 'ltr'
-    print("✓ None改为LTR测试通过")
-    
-    print("✓ 页面翻页方向修复测试通过")
+    book = MockBook(direction)
+    _FIXER._fix_page_progression_direction(book)
+    assert book.direction == 'ltr'
 
 
 def test_image_preservation():
-    """测试图片样式和链接保留"""
-    import zipfile
-    from bs4 import BeautifulSoup
-    
-    # 测试修复后的CSS包含图片缩放规则
-    fixer = EPUBFixer()
-    css = fixer._get_fix_css()
+    """测试修复CSS包含图片缩放规则"""
+    css = _FIXER._get_fix_css()
     
     assert "img" in css
     assert "max-width: 100%" in css
     assert "height: auto" in css
-    print("✓ 修复CSS包含图片缩放规则测试通过")
-    
-    # 测试HTML处理保留head中的link标签
-    html_with_link = '''<?xml version="1.0"?>
-<html xmlns="http://www.w3.org/1999/xhtml">
-<head>
-    <title>Test</title>
-    <link href="style/style.css" rel="stylesheet" type="text/css"/>
-</head>
-<body style="writing-mode: vertical-rl;">
-    <p>测试文本</p>
-    <img src="test.png" alt="图片"/>
-</body>
-</html>'''
-    
-    fixed_html = fixer._fix_html_content(html_with_link.encode('utf-8')).decode('utf-8')
+
+
+def test_html_link_preservation():
+    """测试HTML处理保留原有CSS链接并引用修复样式"""
+    fixed_html = _FIXER._fix_html_content(_HTML_WITH_LINK)
     soup = BeautifulSoup(fixed_html, 'html.parser')
     
     # 检查head部分是否存在
     head = soup.find('head')
     assert head is not None, "Head section should be preserved"
     
-    # 检查link标签是否存在
-    link_tag = head.find('link', {'rel': 'stylesheet'})
+    # 检查原有link标签是否保留
+    link_tag = head.find('link', {'href': 'style/style.css'})
     assert link_tag is not None, "CSS link should be preserved"
-    assert link_tag.get('href') == 'style/style.css'
     
-    # 检查是否添加了修复样式
-    style_tag = head.find('style', {'id': 'epub-fixer-style'})
-    assert style_tag is not None, "Fixer style should be added"
-    assert "img" in style_tag.string, "Image scaling rules should be in fixer style"
+    # 检查是否引用了修复样式
+    fix_link = head.find('link', {'id': 'epub-fixer-style'})
+    assert fix_link is not None, "Fixer stylesheet link should be added"
+    assert fix_link.get('href') == 'epub_fixer.css'
+    assert fix_link.get('rel') == ['stylesheet']
     
-    print("✓ HTML处理保留CSS链接测试通过")
-    print("✓ 图片样式保留测试通过")
+    # 图片保持原样
+    assert soup.find('img').get('src') == 'test.png'
 
 
-def test_svg_image_scaling():
-    """测试SVG图片缩放规则"""
-    from bs4 import BeautifulSoup
+@pytest.mark.parametrize('css_href', ['epub_fixer.css', '../style/epub_fixer.css'])
+def test_fix_link_not_duplicated(css_href):
+    """测试修复样式链接使用传入的相对路径，重复修复时不会重复添加"""
+    fixed_once = _FIXER._fix_html_content(_HTML_WITH_LINK, css_href)
+    fixed_twice = _FIXER._fix_html_content(fixed_once, css_href)
+    assert fixed_twice == fixed_once
     
-    fixer = EPUBFixer()
-    
-    # 测试修复后的CSS包含SVG缩放规则
-    css = fixer._get_fix_css()
+    soup = BeautifulSoup(fixed_twice, 'html.parser')
+    fix_links = soup.find_all('link', {'id': 'epub-fixer-style'})
+    assert len(fix_links) == 1
+    assert fix_links[0].get('href') == css_href
+
+
+def test_svg_image_scaling():
+    """测试修复CSS包含SVG缩放规则"""
+    css = _FIXER._get_fix_css()
     assert "svg" in css
     assert "svg" in css and "max-width: 100%" in css
     assert "svg" in css and "height: auto" in css
-    print("✓ 修复CSS包含SVG缩放规则测试通过")
-    
-    # 测试包含SVG图片的HTML处理
-    html_with_svg = '''<?xml version="1.0" encoding="utf-8"?>
-<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"
-  "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
-<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="ja" class="calibre">
-<head>
-    <title>Test with SVG</title>
-    <meta name="viewport" content="width=1090, height=2048"/>
-</head>
-<body class="calibre1">
-<div class="main">
-<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1" width="100%" height="100%" viewBox="0 0 1090 2048">
-<image width="1090" height="2048" xlink:href="../images/00004.jpeg"/>
-</svg>
-</div>
-</body>
-</html>'''
-    
-    fixed_html = fixer._fix_html_content(html_with_svg.encode('utf-8')).decode('utf-8')
+
+
+def test_svg_html_preservation():
+    """测试包含SVG图片的HTML处理"""
+    fixed_html = _FIXER._fix_html_content(_HTML_WITH_SVG)
     soup = BeautifulSoup(fixed_html, 'html.parser')
     
     # 检查SVG元素是否保留
@@ -222,37 +325,244 @@ def test_svg_image_scaling():
     assert image.get('width') == '1090', "Image width attribute should be preserved"
     assert image.get('height') == '2048', "Image height attribute should be preserved"
     
-    # 检查是否添加了包含SVG样式的修复样式
-    style_tag = soup.find('style', {'id': 'epub-fixer-style'})
-    assert style_tag is not None, "Fixer style should be added"
-    assert "svg" in style_tag.string, "SVG scaling rules should be in fixer style"
+    # 检查是否引用了修复样式
+    fix_link = soup.find('head').find('link', {'id': 'epub-fixer-style'})
+    assert fix_link is not None, "Fixer stylesheet link should be added"
+    assert fix_link.get('href') == 'epub_fixer.css'
+
+
+def test_fix_opf_content():
+    """测试OPF修复：翻页方向改为LTR，并在清单中登记修复CSS文件"""
+    fixed_opf = _FIXER._fix_opf_content(_OPF_FIXTURE, 'style/epub_fixer.css')
+    root = etree.fromstring(fixed_opf)
+    
+    assert root.find('opf:spine', _OPF_NS).get('page-progression-direction') == 'ltr'
     
-    print("✓ SVG图片元素保留测试通过")
-    print("✓ SVG图片缩放样式测试通过")
+    items = root.findall('opf:manifest/opf:item', _OPF_NS)
+    fix_items = [item for item in items if item.get('href') == 'style/epub_fixer.css']
+    assert len(fix_items) == 1
+    assert fix_items[0].get('id') == 'epub-fixer-css'
+    assert fix_items[0].get('media-type') == 'text/css'
+    # 原有条目保持不变
+    assert [item.get('id') for item in items[:-1]] == ['ch1', 'css']
 
 
-if __name__ == "__main__":
-    print("开始测试EPUB修复功能...")
-    print()
+def test_fix_opf_content_id_collision():
+    """测试修复CSS条目的id与已有条目冲突时自动添加后缀"""
+    opf = _OPF_FIXTURE.replace(b'id="css"', b'id="epub-fixer-css"').replace(
+        b'id="ch1"', b'id="epub-fixer-css-2"').replace(b'idref="ch1"', b'idref="epub-fixer-css-2"')
+    fixed_opf = _FIXER._fix_opf_content(opf, 'epub_fixer.css')
+    root = etree.fromstring(fixed_opf)
     
-    try:
-        test_style_fixing()
-        test_css_fixing()
-        test_html_fixing()
-        test_fix_css_generation()
-        test_progress_tracking()
-        test_page_progression_direction()
-        test_image_preservation()
-        test_svg_image_scaling()
-        
-        print()
-        print("=" * 50)
-        print("所有测试通过！✓")
-        print("=" * 50)
-        
-    except AssertionError as e:
-        print(f"\n测试失败: {str(e)}")
-        exit(1)
-    except Exception as e:
-        print(f"\n测试出错: {str(e)}")
-        exit(1)
+    ids = [item.get('id') for item in root.findall('opf:manifest/opf:item', _OPF_NS)]
+    assert ids == ['epub-fixer-css-2', 'epub-fixer-css', 'epub-fixer-css-3']
+
+
+def test_fix_opf_content_already_listed():
+    """测试修复CSS文件已在清单中时不重复登记"""
+    fixed_once = _FIXER._fix_opf_content(_OPF_FIXTURE, 'style/epub_fixer.css')
+    fixed_twice = _FIXER._fix_opf_content(fixed_once, 'style/epub_fixer.css')
+    assert fixed_twice == fixed_once
+    
+    # 已登记的href经过URL编码时同样视为已登记
+    opf = _OPF_FIXTURE.replace(b'href="style/main.css"', b'href="my%20fix.css"')
+    fixed_opf = _FIXER._fix_opf_content(opf, 'my%20fix.css')
+    root = etree.fromstring(fixed_opf)
+    assert len(root.findall('opf:manifest/opf:item', _OPF_NS)) == 2
+
+
+def test_fix_epub_round_trip(tmp_path):
+    """测试修复章节位于子目录的EPUB，重复修复两次后不产生重复内容"""
+    epub_path = str(tmp_path / 'book.epub')
+    _write_epub(epub_path, {
+        'OEBPS/content.opf': _OPF_FIXTURE.replace(b'href="ch1.xhtml"', b'href="Text/ch1.xhtml"'),
+        'OEBPS/Text/ch1.xhtml': _HTML_FIXTURE,
+        'OEBPS/style/main.css': _CSS_FIXTURE,
+    })
+    
+    assert _FIXER.fix_epub(epub_path)
+    with zipfile.ZipFile(epub_path) as zip_file:
+        first_entries = {name: zip_file.read(name) for name in zip_file.namelist()}
+    assert _FIXER.fix_epub(epub_path)
+    
+    with zipfile.ZipFile(epub_path) as zip_file:
+        names = zip_file.namelist()
+        entries = {name: zip_file.read(name) for name in names}
+    
+    # 第二次修复不再改变任何内容
+    assert entries == first_entries
+    assert names[0] == 'mimetype'
+    assert len(names) == len(set(names))
+    assert b'horizontal-tb' in entries['OEBPS/style/epub_fixer.css']
+    
+    # 子目录中的章节使用相对链接引用修复CSS，且只引用一次
+    chapter = entries['OEBPS/Text/ch1.xhtml']
+    assert chapter.count(b'id="epub-fixer-style"') == 1
+    assert b'href="../style/epub_fixer.css"' in chapter
+    assert b'vertical-rl' not in chapter
+    
+    # 修复CSS只在清单中登记一次，原CSS也已修复
+    root = etree.fromstring(entries['OEBPS/content.opf'])
+    hrefs = [item.get('href') for item in root.findall('opf:manifest/opf:item', _OPF_NS)]
+    assert hrefs.count('style/epub_fixer.css') == 1
+    assert b'vertical-rl' not in entries['OEBPS/style/main.css']
+
+
+def test_fix_epub_fast(tmp_path):
+    """测试fast模式输出的EPUB完整可读，mimetype仍为第一个未压缩条目"""
+    epub_path = str(tmp_path / 'book.epub')
+    output_path = str(tmp_path / 'book_fast.epub')
+    _write_epub(epub_path, {
+        'OEBPS/content.opf': _OPF_FIXTURE,
+        'OEBPS/ch1.xhtml': _HTML_FIXTURE,
+        'OEBPS/style/main.css': _CSS_FIXTURE,
+    })
+    
+    assert _FIXER.fix_epub(epub_path, output_path, fast=True)
+    with zipfile.ZipFile(output_path) as zip_file:
+        assert zip_file.testzip() is None
+        infos = zip_file.infolist()
+        entries = {info.filename: zip_file.read(info) for info in infos}
+    
+    assert infos[0].filename == 'mimetype'
+    assert infos[0].compress_type == zipfile.ZIP_STORED
+    assert entries['mimetype'] == b'application/epub+zip'
+    assert b'horizontal-tb' in entries['OEBPS/ch1.xhtml']
+    assert b'vertical-rl' not in entries['OEBPS/style/main.css']
+    assert b'horizontal-tb' in entries['OEBPS/style/epub_fixer.css']
+
+
+def test_fix_epub_compress_type(tmp_path):
+    """测试重新打包时各条目的压缩方式：原本未压缩的保持不压缩，媒体文件直接存储，字体仍deflate"""
+    epub_path = str(tmp_path / 'book.epub')
+    _write_epub(epub_path, {
+        'OEBPS/content.opf': _OPF_FIXTURE,
+        'OEBPS/ch1.xhtml': _HTML_FIXTURE,
+        'OEBPS/image.jpg': b'\xff\xd8' + b'A' * 256,
+        'OEBPS/cover.png': b'\x89PNG' + b'B' * 256,
+        'OEBPS/fonts/font.ttf': b'\x00\x01\x00\x00' + b'C' * 256,
+    })
+    with zipfile.ZipFile(epub_path, 'a') as zip_file:
+        zip_file.writestr('OEBPS/notes.txt', b'D' * 256, compress_type=zipfile.ZIP_STORED)
+    
+    assert _FIXER.fix_epub(epub_path)
+    with zipfile.ZipFile(epub_path) as zip_file:
+        compress_types = {info.filename: info.compress_type for info in zip_file.infolist()}
+    
+    assert compress_types['mimetype'] == zipfile.ZIP_STORED
+    assert compress_types['OEBPS/notes.txt'] == zipfile.ZIP_STORED
+    assert compress_types['OEBPS/image.jpg'] == zipfile.ZIP_STORED
+    assert compress_types['OEBPS/cover.png'] == zipfile.ZIP_STORED
+    assert compress_types['OEBPS/fonts/font.ttf'] == zipfile.ZIP_DEFLATED
+    assert compress_types['OEBPS/ch1.xhtml'] == zipfile.ZIP_DEFLATED
+
+
+@pytest.mark.parametrize('count, max_workers', [(1, None), (2, 1)])
+def test_batch_fix_in_process(tmp_path, count, max_workers):
+    """测试只有一个文件或只允许一个进程时直接在当前进程批量修复"""
+    input_paths = []
+    for i in range(count):
+        epub_path = str(tmp_path / f'book{i}.epub')
+        _write_epub(epub_path, {
+            'OEBPS/content.opf': _OPF_FIXTURE,
+            'OEBPS/ch1.xhtml': _HTML_FIXTURE,
+        })
+        input_paths.append(epub_path)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    
+    fixer = EPUBFixer()
+    result = fixer.batch_fix(input_paths, str(output_dir), max_workers=max_workers)
+    assert result == {'total': count, 'success': count, 'failed': 0, 'failed_files': []}
+    assert fixer.get_progress()[:2] == (count, count)
+    for i in range(count):
+        with zipfile.ZipFile(output_dir / f'book{i}.epub') as zip_file:
+            assert b'horizontal-tb' in zip_file.read('OEBPS/ch1.xhtml')
+
+
+def _corrupt_entry_data(epub_path):
+    """构造未压缩图片条目的CRC校验失败的EPUB，复制到该条目时才会出错"""
+    _write_epub(epub_path, {
+        'OEBPS/content.opf': _OPF_FIXTURE,
+        'OEBPS/ch1.xhtml': _HTML_FIXTURE,
+    })
+    with zipfile.ZipFile(epub_path, 'a') as zip_file:
+        zip_file.writestr('OEBPS/image.png', b'A' * 64, compress_type=zipfile.ZIP_STORED)
+    with open(epub_path, 'rb') as f:
+        data = f.read()
+    with open(epub_path, 'wb') as f:
+        f.write(data.replace(b'A' * 64, b'B' * 64))
+
+
+def _not_a_zip(epub_path):
+    """构造根本不是ZIP格式的EPUB"""
+    with open(epub_path, 'wb') as f:
+        f.write(b'this is not an epub file')
+
+
+@pytest.mark.parametrize('make_corrupt_epub', [_corrupt_entry_data, _not_a_zip])
+def test_fix_epub_failure_keeps_original(tmp_path, make_corrupt_epub):
+    """测试覆盖原文件时修复失败，原文件保持不变且不残留临时文件"""
+    epub_path = str(tmp_path / 'book.epub')
+    make_corrupt_epub(epub_path)
+    with open(epub_path, 'rb') as f:
+        original = f.read()
+    
+    assert not _FIXER.fix_epub(epub_path, epub_path)
+    
+    with open(epub_path, 'rb') as f:
+        assert f.read() == original
+    assert os.listdir(tmp_path) == ['book.epub']
+
+
+@pytest.mark.parametrize('container, files, expected', [
+    # 按container.xml中的full-path查找，优先于目录扫描
+    (_CONTAINER_FIXTURE, ['EPUB/other.opf', 'OEBPS/content.opf'], 'OEBPS/content.opf'),
+    # container.xml缺失时退回到在常见目录中查找
+    (None, ['OEBPS/Text/ch1.xhtml', 'OEBPS/content.opf'], 'OEBPS/content.opf'),
+    # container.xml无法解析时同样退回到目录扫描
+    (b'<container><rootfiles>', ['EPUB/package.opf'], 'EPUB/package.opf'),
+    # full-path指向不存在的条目
+    (_CONTAINER_FIXTURE.replace(b'OEBPS/content.opf', b'missing.opf'), ['EPUB/package.opf'],
+     'EPUB/package.opf'),
+    # OPF位于压缩包根目录
+    (_CONTAINER_FIXTURE.replace(b'OEBPS/content.opf', b'content.opf'), ['content.opf'], 'content.opf'),
+    (None, ['content.opf', 'Text/ch1.xhtml'], 'content.opf'),
+    # 子目录中非常见位置的OPF不会被目录扫描误认
+    (None, ['OEBPS/Text/nested.opf'], None),
+])
+def test_find_opf_name(container, files, expected):
+    """测试通过container.xml或目录扫描查找OPF文件"""
+    buffer = io.BytesIO()
+    _write_epub(buffer, {name: _OPF_FIXTURE for name in files}, container=container)
+    with zipfile.ZipFile(buffer) as zip_file:
+        assert _FIXER._find_opf_name(zip_file) == expected
+
+
+_MANIFEST_OPF = b"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="ch1" href="Text/ch%201.xhtml" media-type="application/xhtml+xml"/>
+    <item id="ch2" href="Text/../Text/ch2.html" media-type="text/html"/>
+    <item id="css" href="Styles/main.css" media-type="text/css"/>
+    <item id="img" href="Images/cover.jpg" media-type="image/jpeg"/>
+    <item id="nohref" media-type="application/xhtml+xml"/>
+  </manifest>
+</package>
+"""
+
+
+@pytest.mark.parametrize('opf_name, prefix', [
+    ('OEBPS/content.opf', 'OEBPS/'),
+    # OPF位于压缩包根目录
+    ('content.opf', ''),
+])
+def test_read_manifest(opf_name, prefix):
+    """测试从OPF清单解析HTML/CSS条目在压缩包中的路径"""
+    manifest = _FIXER._read_manifest(opf_name, _MANIFEST_OPF)
+    assert manifest == {
+        # URL编码的href解码后对应压缩包条目名
+        prefix + 'Text/ch 1.xhtml': 'html',
+        prefix + 'Text/ch2.html': 'html',
+        prefix + 'Styles/main.css': 'css',
+    }
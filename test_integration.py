@@ -4,12 +4,51 @@
 集成测试：测试完整的EPUB修复流程
 """
 
+import functools
 import os
+import re
+import shutil
 import sys
+import create_test_epub as create_test_epub_module
 from create_test_epub import create_test_epub
 from epub_fixer import EPUBFixer
+import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+
+
+# body标签的style属性值（测试文件格式规范，属性均用双引号）
+_BODY_STYLE_RE = re.compile(rb'<body\b[^>]*\sstyle\s*=\s*"([^"]*)"', re.IGNORECASE)
+# HTML中需要检查的标记：横排样式、修复样式引用、竖排关键字（不区分大小写）
+_FLAGS_RE = re.compile(rb'horizontal-tb|epub-fixer-style|(?i:vertical)')
+# style属性中的竖排/横排关键字
+_VERTICAL_RE = re.compile('vertical', re.IGNORECASE)
+_HORIZONTAL_RE = re.compile('horizontal', re.IGNORECASE)
+# CSS中未被注释、也未改为横排的竖排writing-mode声明所在行
+_VERTICAL_CSS_LINE_RE = re.compile(
+    rb'^(?![ \t]*/\*)(?=[^\n]*writing-mode)(?=[^\n]*vertical)(?![^\n]*horizontal)[^\n]*',
+    re.IGNORECASE | re.MULTILINE)
+
+
+# create_test_epub生成的测试文件路径
+_TEST_EPUB_PATH = '/tmp/test_vertical_text.epub'
+# 批量处理测试中同时修复的文件数
+_BATCH_SIZE = 4
+# 批量处理测试的输入、输出目录，在导入时创建一次
+_BATCH_INPUT_DIR = '/tmp/batch_test_input'
+_BATCH_OUTPUT_DIR = '/tmp/batch_test'
+for _batch_dir in (_BATCH_INPUT_DIR, _BATCH_OUTPUT_DIR):
+    if not os.path.isdir(_batch_dir):
+        os.makedirs(_batch_dir, exist_ok=True)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_test_epub():
+    """获取测试EPUB文件；已生成且不早于生成脚本时直接复用，避免每次重新打包"""
+    source_path = create_test_epub_module.__file__
+    if (os.path.exists(_TEST_EPUB_PATH)
+            and os.path.getmtime(_TEST_EPUB_PATH) >= os.path.getmtime(source_path)):
+        return _TEST_EPUB_PATH
+    return create_test_epub()
 
 
 def test_full_workflow():
@@ -21,7 +60,7 @@ def test_full_workflow():
     
     # 步骤1：创建测试EPUB文件
     print("步骤1: 创建包含竖排问题的测试EPUB文件...")
-    input_path = create_test_epub()
+    input_path = _get_test_epub()
     print(f"✓ 测试文件已创建: {input_path}")
     print()
     
@@ -30,12 +69,12 @@ def test_full_workflow():
     book_original = epub.read_epub(input_path)
     
     has_vertical = False
-    for item in book_original.get_items():
-        if item.get_type() == 9:  # HTML文档
-            content = item.get_content().decode('utf-8')
-            if 'vertical' in content.lower():
-                has_vertical = True
-                print(f"✓ 在 {item.get_name()} 中发现竖排样式")
+    for item in book_original.get_items_of_type(ebooklib.ITEM_DOCUMENT):
+        # 只需确认存在竖排样式，找到第一个即可停止
+        if b'vertical' in item.get_content():
+            has_vertical = True
+            print(f"✓ 在 {item.get_name()} 中发现竖排样式")
+            break
     
     if not has_vertical:
         print("✗ 错误：测试文件中没有找到竖排样式")
@@ -65,50 +104,51 @@ def test_full_workflow():
     has_fix_style = False
     
     with zipfile.ZipFile(output_path, 'r') as zip_file:
-        # 检查HTML文件
-        for name in zip_file.namelist():
-            if name.endswith('.xhtml') or name.endswith('.html'):
-                with zip_file.open(name) as f:
-                    content = f.read().decode('utf-8')
-                    
-                    # 检查是否还有竖排样式（在非注释中）
-                    soup = BeautifulSoup(content, 'html.parser')
-                    
-                    # 检查body的style
-                    body = soup.find('body')
-                    if body and body.get('style'):
-                        style = body.get('style', '')
-                        if 'vertical' in style.lower() and 'horizontal' not in style.lower():
-                            still_has_vertical = True
-                            print(f"✗ {name} 中仍有未修复的竖排样式")
-                    
-                    # 检查是否有横排样式
-                    if 'horizontal-tb' in content:
+        # 一次遍历所有条目，按扩展名分别检查HTML和CSS文件
+        for info in zip_file.infolist():
+            name = info.filename
+            if name.endswith(('.xhtml', '.html')):
+                raw = zip_file.read(info)
+                
+                # 一次扫描同时检查横排样式、修复样式引用和竖排关键字
+                mentions_vertical = False
+                for match in _FLAGS_RE.finditer(raw):
+                    token = match.group(0)
+                    if token == b'horizontal-tb':
                         has_horizontal = True
-                    
-                    # 检查是否注入了修复样式
-                    if 'epub-fixer-style' in content:
-                        has_fix_style = True
-        
-        # 检查CSS文件
-        for name in zip_file.namelist():
-            if name.endswith('.css'):
-                with zip_file.open(name) as f:
-                    content = f.read().decode('utf-8')
-                    
-                    # 检查是否有修复样式CSS文件
-                    if 'epub_fixer' in name:
+                    elif token == b'epub-fixer-style':
                         has_fix_style = True
-                    
-                    # 检查竖排样式是否被注释或修复
-                    lines = content.split('\n')
-                    for line in lines:
-                        if 'writing-mode' in line.lower() and 'vertical' in line.lower():
-                            if not line.strip().startswith('/*'):
-                                # 检查是否已被替换为horizontal
-                                if 'horizontal' not in line.lower():
-                                    still_has_vertical = True
-                                    print(f"✗ CSS文件 {name} 中仍有未修复的竖排样式: {line.strip()}")
+                    else:
+                        mentions_vertical = True
+                    if has_horizontal and has_fix_style and mentions_vertical:
+                        break
+                
+                # 含竖排关键字时再检查body的style是否仍为竖排
+                # 只需要读取body的style属性，用正则直接提取，不解析文档
+                if mentions_vertical:
+                    match = _BODY_STYLE_RE.search(raw)
+                    if match and match.group(1):
+                        style = match.group(1).decode('utf-8')
+                        if _VERTICAL_RE.search(style) and not _HORIZONTAL_RE.search(style):
+                            still_has_vertical = True
+                            print(f"✗ {name} 中仍有未修复的竖排样式")
+            
+            elif name.endswith('.css'):
+                raw = zip_file.read(info)
+                
+                # 检查是否有修复样式CSS文件
+                if 'epub_fixer' in name:
+                    has_fix_style = True
+                
+                # 检查竖排样式是否被注释或修复（已被替换为horizontal的行不计入）
+                for match in _VERTICAL_CSS_LINE_RE.finditer(raw):
+                    still_has_vertical = True
+                    line = match.group(0).decode('utf-8').strip()
+                    print(f"✗ CSS文件 {name} 中仍有未修复的竖排样式: {line}")
+            
+            # 三项检查结果都已确定，无需继续扫描
+            if still_has_vertical and has_horizontal and has_fix_style:
+                break
     
     print()
     print("验证结果:")
@@ -119,17 +159,19 @@ def test_full_workflow():
     
     # 步骤5：测试批量处理
     print("步骤5: 测试批量处理功能...")
-    test_files = [input_path]
-    output_dir = '/tmp/batch_test'
-    os.makedirs(output_dir, exist_ok=True)
-    
-    result = fixer.batch_fix(test_files, output_dir)
+    # 复制出多个不同文件名的输入，让多个工作进程同时处理
+    test_files = []
+    for i in range(_BATCH_SIZE):
+        test_file = os.path.join(_BATCH_INPUT_DIR, f"book{i}.epub")
+        shutil.copyfile(input_path, test_file)
+        test_files.append(test_file)
+    result = fixer.batch_fix(test_files, _BATCH_OUTPUT_DIR, max_workers=os.cpu_count())
     
     print(f"  总计: {result['total']} 个文件")
     print(f"  成功: {result['success']} 个")
     print(f"  失败: {result['failed']} 个")
     
-    batch_success = result['success'] == 1 and result['failed'] == 0
+    batch_success = result['success'] == _BATCH_SIZE and result['failed'] == 0
     print(f"  {'✓' if batch_success else '✗'} 批量处理测试")
     print()
     